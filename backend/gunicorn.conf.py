@@ -0,0 +1,26 @@
+"""
+gunicorn.conf.py
+Production settings for the LANA server
+
+Run with: gunicorn -c gunicorn.conf.py lana_server_fixed:app
+"""
+
+import json
+import os
+
+with open("lana_config.json", "r") as f:
+    _server = json.load(f).get("server", {})
+
+bind = f"{_server.get('host', '0.0.0.0')}:{_server.get('port', 6969)}"
+
+# Each gevent worker multiplexes many in-flight LM Studio calls
+worker_class = "gevent"
+worker_connections = 1000
+
+# Conversation memory lives in-process and is appended to one file, so
+# default to a single worker. Set LANA_WORKERS (e.g. 2 * cores + 1) only
+# once memory is moved to shared storage.
+workers = int(os.getenv("LANA_WORKERS", 1))
+
+# LLM generations can take minutes
+timeout = 180
@@ -7,11 +7,32 @@ Test script to diagnose connection issues between:
 This tests the entire connection chain.
 """
 
+import functools
 import json
+import os
 import requests
+from requests.adapters import HTTPAdapter
 import socket
+import sys
 import time
-from typing import Dict, Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from lana_common import LOADING_RETRY, buffered, extract_content, load_config_cached
+
+
+@functools.lru_cache(maxsize=1)
+def _detect_local_ip() -> str:
+    """Find the outbound interface IP once; it rarely changes per process"""
+    try:
+        # Connect to external address to determine local IP
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        local_ip = s.getsockname()[0]
+        s.close()
+        return local_ip
+    except Exception:
+        return "127.0.0.1"
 
 
 class HomelinkConnectionTest:
@@ -22,70 +43,97 @@ class HomelinkConnectionTest:
         self.local_ip = None
         self.issues = []
         self.warnings = []
+        
+        self._buf: List[str] = []  # Pending output, see _emit/_flush
+        
+        # Shared session so every probe reuses the same keep-alive connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=LOADING_RETRY)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def _emit(self, line: str = ""):
+        """Queue a line of output; written in one go by _flush"""
+        self._buf.append(line)
+    
+    def _flush(self):
+        """Write all queued output with a single stdout call"""
+        if self._buf:
+            sys.stdout.write("\n".join(self._buf) + "\n")
+            self._buf.clear()
     
     def get_local_ip(self) -> str:
         """Get the local IP address of this machine"""
-        try:
-            # Connect to external address to determine local IP
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            return local_ip
-        except Exception:
-            return "127.0.0.1"
+        return _detect_local_ip()
     
     def run_all_tests(self):
         """Run complete diagnostic suite"""
-        print("=" * 70)
-        print("🔍 HOMELINK APP → LANA SERVER → LM STUDIO CONNECTION TEST")
-        print("=" * 70)
-        print()
+        try:
+            return self._run_all_tests()
+        finally:
+            self._flush()
+            self.session.close()
+    
+    def _run_all_tests(self):
+        self._emit("=" * 70)
+        self._emit("🔍 HOMELINK APP → LANA SERVER → LM STUDIO CONNECTION TEST")
+        self._emit("=" * 70)
+        self._emit()
         
         # Get local IP
         self.local_ip = self.get_local_ip()
-        print(f"📍 Your PC's IP Address: {self.local_ip}")
-        print(f"   Use this in your Homelink app settings!\n")
+        self._emit(f"📍 Your PC's IP Address: {self.local_ip}")
+        self._emit(f"   Use this in your Homelink app settings!\n")
         
         # Step 1: Load config
         if not self.test_config():
-            print("\n❌ STOP: Fix configuration first")
+            self._emit("\n❌ STOP: Fix configuration first")
             self.print_config_help()
             return False
         
-        # Step 2: Test LM Studio
-        if not self.test_lm_studio():
-            print("\n❌ STOP: Fix LM Studio connection first")
-            self.print_lm_studio_help()
-            return False
-        
-        # Step 3: Test LANA server
-        if not self.test_lana_server():
-            print("\n⚠️ WARNING: LANA server not running")
-            self.print_server_help()
-        
-        # Step 4: Test from "mobile" perspective
-        self.test_mobile_connection()
+        # The LANA server probe is independent of LM Studio, so start it now
+        # and let it overlap with Step 2
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            lana_probe = executor.submit(self._probe_lana_server)
+            
+            # Step 2: Test LM Studio
+            if not self.test_lm_studio():
+                self._emit("\n❌ STOP: Fix LM Studio connection first")
+                self.print_lm_studio_help()
+                return False
+            
+            # LM Studio is up, so send the mobile-facing requests now and let
+            # them overlap with the local server check
+            mobile_probe = self._probe_mobile(executor)
+            
+            # Step 3: Test LANA server
+            if not self.test_lana_server(lana_probe):
+                self._emit("\n⚠️ WARNING: LANA server not running")
+                self.print_server_help()
+            
+            # Step 4: Test from "mobile" perspective
+            self.test_mobile_connection(mobile_probe)
         
         # Summary
-        print("\n" + "=" * 70)
+        self._emit("\n" + "=" * 70)
         self.print_summary()
-        print("=" * 70)
+        self._emit("=" * 70)
         
         return len(self.issues) == 0
     
+    @buffered
     def test_config(self) -> bool:
         """Test if config file exists and is valid"""
-        print("📋 Step 1: Checking configuration...")
+        self._emit("📋 Step 1: Checking configuration...")
         
         try:
-            with open("lana_config.json", "r") as f:
-                self.config = json.load(f)
+            mtime = os.path.getmtime("lana_config.json")
+            self.config = load_config_cached("lana_config.json", mtime)
             
             # Check required fields
             if "lm_studio" not in self.config:
                 self.issues.append("Missing 'lm_studio' in config")
-                print("   ❌ Config missing LM Studio settings")
+                self._emit("   ❌ Config missing LM Studio settings")
                 return False
             
             lm_config = self.config["lm_studio"]
@@ -93,34 +141,35 @@ class HomelinkConnectionTest:
             
             if not base_url:
                 self.issues.append("Missing LM Studio base_url")
-                print("   ❌ Config missing LM Studio URL")
+                self._emit("   ❌ Config missing LM Studio URL")
                 return False
             
-            print(f"   ✅ Config loaded")
-            print(f"   📡 LM Studio URL: {base_url}")
+            self._emit(f"   ✅ Config loaded")
+            self._emit(f"   📡 LM Studio URL: {base_url}")
             
             # Check if URL matches local IP
             if "localhost" in base_url or "127.0.0.1" in base_url:
                 self.warnings.append(
                     "LM Studio URL uses localhost - mobile app won't be able to connect"
                 )
-                print(f"   ⚠️ Config uses localhost (won't work from mobile)")
-                print(f"   💡 Change to: http://{self.local_ip}:1234")
+                self._emit(f"   ⚠️ Config uses localhost (won't work from mobile)")
+                self._emit(f"   💡 Change to: http://{self.local_ip}:1234")
             
             return True
             
         except FileNotFoundError:
             self.issues.append("lana_config.json not found")
-            print("   ❌ Config file not found")
+            self._emit("   ❌ Config file not found")
             return False
         except json.JSONDecodeError:
             self.issues.append("Invalid JSON in config")
-            print("   ❌ Config has syntax errors")
+            self._emit("   ❌ Config has syntax errors")
             return False
     
+    @buffered
     def test_lm_studio(self) -> bool:
         """Test LM Studio connection"""
-        print("\n🤖 Step 2: Testing LM Studio connection...")
+        self._emit("\n🤖 Step 2: Testing LM Studio connection...")
         
         if not self.config:
             return False
@@ -129,238 +178,295 @@ class HomelinkConnectionTest:
         models_endpoint = lm_url + "/v1/models"
         
         try:
-            print(f"   Testing: {models_endpoint}")
-            response = requests.get(models_endpoint, timeout=5)
-            response.raise_for_status()
+            self._emit(f"   Testing: {models_endpoint}")
+            response = self.session.get(models_endpoint, timeout=5)
+            
+            if response.status_code >= 400:
+                self.issues.append(f"LM Studio error: HTTP {response.status_code}")
+                self._emit(f"   ❌ Error: HTTP {response.status_code}")
+                return False
             
             data = response.json()
             models = [m["id"] for m in data.get("data", [])]
             
-            print(f"   ✅ LM Studio is running")
-            print(f"   📦 Loaded models: {len(models)}")
+            self._emit(f"   ✅ LM Studio is running")
+            self._emit(f"   📦 Loaded models: {len(models)}")
             for model in models:
-                print(f"      • {model}")
+                self._emit(f"      • {model}")
             
             # Check if configured model is loaded
             configured_model = self.config.get("models", {}).get("primary")
             if configured_model and configured_model not in models:
                 self.warnings.append(f"Configured model '{configured_model}' not loaded")
-                print(f"   ⚠️ Your configured model is not loaded!")
-                print(f"      Expected: {configured_model}")
+                self._emit(f"   ⚠️ Your configured model is not loaded!")
+                self._emit(f"      Expected: {configured_model}")
             
             return True
             
         except requests.exceptions.ConnectionError:
             self.issues.append("Cannot connect to LM Studio")
-            print(f"   ❌ Cannot connect to {lm_url}")
-            print(f"   💡 Is LM Studio running? Is server started?")
+            self._emit(f"   ❌ Cannot connect to {lm_url}")
+            self._emit(f"   💡 Is LM Studio running? Is server started?")
             return False
         
         except Exception as e:
             self.issues.append(f"LM Studio error: {e}")
-            print(f"   ❌ Error: {e}")
+            self._emit(f"   ❌ Error: {e}")
             return False
     
-    def test_lana_server(self) -> bool:
-        """Test if LANA server is running"""
-        print("\n🖤 Step 3: Testing LANA server...")
-        
+    def _server_port(self) -> int:
+        """LANA server port from config"""
         server_config = self.config.get("server", {})
-        port = server_config.get("port", 6969)
+        return server_config.get("port", 6969)
+    
+    def _lana_local_url(self) -> str:
+        """Localhost URL of the LANA server"""
+        return f"http://localhost:{self._server_port()}/"
+    
+    def _probe_lana_server(self) -> Tuple[Optional[requests.Response], Optional[Exception]]:
+        """GET the LANA server root, returning (response, error)"""
+        try:
+            return self.session.get(self._lana_local_url(), timeout=3), None
+        except Exception as e:
+            return None, e
+    
+    @buffered
+    def test_lana_server(self, probe: Optional[Future] = None) -> bool:
+        """Test if LANA server is running"""
+        self._emit("\n🖤 Step 3: Testing LANA server...")
         
         # Test localhost
-        local_url = f"http://localhost:{port}/"
+        local_url = self._lana_local_url()
+        self._emit(f"   Testing: {local_url}")
+        
+        response, err = probe.result() if probe else self._probe_lana_server()
         
         try:
-            print(f"   Testing: {local_url}")
-            response = requests.get(local_url, timeout=3)
+            if err is not None:
+                raise err
             
             if response.status_code == 200:
                 data = response.json()
-                print(f"   ✅ LANA server is running")
-                print(f"   📡 Service: {data.get('service', 'unknown')}")
-                print(f"   👤 User: {data.get('user', 'unknown')}")
-                print(f"   🔌 LM Studio: {data.get('lm_studio', 'unknown')}")
+                self._emit(f"   ✅ LANA server is running")
+                self._emit(f"   📡 Service: {data.get('service', 'unknown')}")
+                self._emit(f"   👤 User: {data.get('user', 'unknown')}")
+                self._emit(f"   🔌 LM Studio: {data.get('lm_studio', 'unknown')}")
                 return True
             else:
                 self.warnings.append(f"LANA server returned status {response.status_code}")
-                print(f"   ⚠️ Server responded with status {response.status_code}")
+                self._emit(f"   ⚠️ Server responded with status {response.status_code}")
                 return True
                 
         except requests.exceptions.ConnectionError:
             self.warnings.append("LANA server not running")
-            print(f"   ❌ LANA server is not running")
-            print(f"   💡 Start it with: python lana_server_fixed.py")
+            self._emit(f"   ❌ LANA server is not running")
+            self._emit(f"   💡 Start it with: python lana_server_fixed.py")
             return False
         
         except Exception as e:
             self.warnings.append(f"Server test error: {e}")
-            print(f"   ⚠️ Error: {e}")
+            self._emit(f"   ⚠️ Error: {e}")
             return False
     
-    def test_mobile_connection(self):
+    def _probe_mobile(self, executor: ThreadPoolExecutor) -> Tuple[bool, Optional[Future], Optional[Future]]:
+        """
+        TCP-check the mobile-facing port, then send the root GET and chat
+        POST together on the executor. Returns (reachable, root, chat).
+        """
+        port = self._server_port()
+        
+        # A bare TCP connect answers "is the port open" far quicker than HTTP
+        try:
+            s = socket.create_connection((self.local_ip, port), timeout=1)
+            s.close()
+        except OSError:
+            return False, None, None
+        
+        mobile_url = f"http://{self.local_ip}:{port}/"
+        chat_url = f"http://{self.local_ip}:{port}/v1/chat/completions"
+        test_payload = {
+            "prompt": "test",
+            "linked_user": "Homelink Test"
+        }
+        
+        root = executor.submit(self.session.get, mobile_url, timeout=3)
+        chat = executor.submit(self.session.post, chat_url, json=test_payload, timeout=10)
+        return True, root, chat
+    
+    @buffered
+    def test_mobile_connection(self, probe: Optional[Tuple[bool, Optional[Future], Optional[Future]]] = None):
         """Test connection as if from mobile app"""
-        print("\n📱 Step 4: Testing mobile app perspective...")
+        self._emit("\n📱 Step 4: Testing mobile app perspective...")
         
-        server_config = self.config.get("server", {})
-        port = server_config.get("port", 6969)
+        port = self._server_port()
         
         # Test via local IP (how mobile would connect)
         mobile_url = f"http://{self.local_ip}:{port}/"
         
-        print(f"   Mobile app should connect to: {mobile_url}")
+        self._emit(f"   Mobile app should connect to: {mobile_url}")
         
-        try:
-            print(f"   Testing from mobile perspective...")
-            response = requests.get(mobile_url, timeout=3)
-            
-            if response.status_code == 200:
-                print(f"   ✅ Mobile app can reach server at {mobile_url}")
-            else:
-                self.warnings.append("Mobile connection returned unexpected status")
-                print(f"   ⚠️ Got status {response.status_code}")
+        self._emit(f"   Testing from mobile perspective...")
         
-        except requests.exceptions.ConnectionError:
+        if probe is None:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                probe = self._probe_mobile(executor)
+        reachable, root_probe, chat_probe = probe
+        
+        if not reachable:
             self.issues.append("Mobile app cannot reach server")
-            print(f"   ❌ Mobile app CANNOT reach server at {mobile_url}")
-            print(f"   💡 Possible causes:")
-            print(f"      • LANA server not running")
-            print(f"      • Firewall blocking port {port}")
-            print(f"      • Phone and PC on different networks")
-            
-        except Exception as e:
-            self.warnings.append(f"Mobile test error: {e}")
-            print(f"   ⚠️ Error: {e}")
+            self._emit(f"   ❌ Mobile app CANNOT reach server at {mobile_url}")
+            self._emit(f"   💡 Possible causes:")
+            self._emit(f"      • LANA server not running")
+            self._emit(f"      • Firewall blocking port {port}")
+            self._emit(f"      • Phone and PC on different networks")
+        
+        else:
+            # Port is open; check the server actually answers
+            try:
+                response = root_probe.result()
+                
+                if response.status_code == 200:
+                    self._emit(f"   ✅ Mobile app can reach server at {mobile_url}")
+                else:
+                    self.warnings.append("Mobile connection returned unexpected status")
+                    self._emit(f"   ⚠️ Got status {response.status_code}")
+                
+            except Exception as e:
+                self.warnings.append(f"Mobile test error: {e}")
+                self._emit(f"   ⚠️ Error: {e}")
         
         # Test chat endpoint
         chat_url = f"http://{self.local_ip}:{port}/v1/chat/completions"
-        print(f"\n   Testing chat endpoint: {chat_url}")
+        self._emit(f"\n   Testing chat endpoint: {chat_url}")
+        
+        if not reachable:
+            self._emit(f"   ❌ Chat endpoint not reachable")
+            return
         
         try:
-            test_payload = {
-                "prompt": "test",
-                "linked_user": "Homelink Test"
-            }
-            
-            response = requests.post(chat_url, json=test_payload, timeout=10)
+            response = chat_probe.result()
             
             if response.status_code == 200:
-                data = response.json()
-                message = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-                print(f"   ✅ Chat endpoint works!")
-                print(f"   💬 Response: {message[:80]}...")
+                # Only the reply text matters here, so skip building the full JSON tree
+                message = extract_content(response.text) or ""
+                self._emit(f"   ✅ Chat endpoint works!")
+                self._emit(f"   💬 Response: {message[:80]}...")
             else:
-                print(f"   ⚠️ Chat endpoint returned status {response.status_code}")
+                self._emit(f"   ⚠️ Chat endpoint returned status {response.status_code}")
         
         except requests.exceptions.ConnectionError:
-            print(f"   ❌ Chat endpoint not reachable")
+            self._emit(f"   ❌ Chat endpoint not reachable")
         
         except Exception as e:
-            print(f"   ⚠️ Chat test error: {e}")
+            self._emit(f"   ⚠️ Chat test error: {e}")
     
+    @buffered
     def print_config_help(self):
         """Print help for fixing config"""
-        print("\n" + "=" * 70)
-        print("🔧 HOW TO FIX CONFIG")
-        print("=" * 70)
-        print("\n1. Create lana_config.json in the same folder as your server")
-        print("\n2. Copy this template and update the values:\n")
-        print('''{
-  "lm_studio": {
-    "host": "''' + self.local_ip + '''",
+        self._emit("\n" + "=" * 70)
+        self._emit("🔧 HOW TO FIX CONFIG")
+        self._emit("=" * 70)
+        self._emit("\n1. Create lana_config.json in the same folder as your server")
+        self._emit("\n2. Copy this template and update the values:\n")
+        self._emit(f'''{{
+  "lm_studio": {{
+    "host": "{self.local_ip}",
     "port": 1234,
-    "base_url": "http://''' + self.local_ip + ''':1234",
-    "endpoints": {
+    "base_url": "http://{self.local_ip}:1234",
+    "endpoints": {{
       "chat": "/v1/chat/completions",
       "models": "/v1/models"
-    }
-  },
-  "models": {
+    }}
+  }},
+  "models": {{
     "primary": "kimi-vl-a3b-thinking-2506",
     "vision": "zai-org/glm-4.6v-flash"
-  },
-  "server": {
+  }},
+  "server": {{
     "host": "0.0.0.0",
     "port": 6969
-  },
-  "timeouts": {
+  }},
+  "timeouts": {{
     "chat_completion": 120,
     "vision_request": 60,
     "health_check": 5
-  }
-}''')
-        print("\n3. Make sure to use your PC's IP address, not localhost!")
+  }}
+}}''')
+        self._emit("\n3. Make sure to use your PC's IP address, not localhost!")
     
+    @buffered
     def print_lm_studio_help(self):
         """Print help for fixing LM Studio"""
-        print("\n" + "=" * 70)
-        print("🔧 HOW TO FIX LM STUDIO")
-        print("=" * 70)
-        print("\n1. Open LM Studio")
-        print("2. Go to 'Local Server' tab")
-        print("3. Load a model (e.g., kimi-vl-a3b-thinking-2506)")
-        print("4. Click 'Start Server'")
-        print("5. Note the address shown (should be like http://192.168.1.109:1234)")
-        print("6. Update lana_config.json with this address")
+        self._emit("\n" + "=" * 70)
+        self._emit("🔧 HOW TO FIX LM STUDIO")
+        self._emit("=" * 70)
+        self._emit("\n1. Open LM Studio")
+        self._emit("2. Go to 'Local Server' tab")
+        self._emit("3. Load a model (e.g., kimi-vl-a3b-thinking-2506)")
+        self._emit("4. Click 'Start Server'")
+        self._emit("5. Note the address shown (should be like http://192.168.1.109:1234)")
+        self._emit("6. Update lana_config.json with this address")
     
+    @buffered
     def print_server_help(self):
         """Print help for starting server"""
-        print("\n" + "=" * 70)
-        print("🔧 HOW TO START LANA SERVER")
-        print("=" * 70)
-        print("\n1. Open terminal in your LANA project folder")
-        print("2. Run: python lana_server_fixed.py")
-        print("3. You should see:")
-        print("   ✅ LM Studio connection established")
-        print("   🚀 LANA OS-Link Ready")
-        print(f"\n4. Server will listen on port 6969")
+        self._emit("\n" + "=" * 70)
+        self._emit("🔧 HOW TO START LANA SERVER")
+        self._emit("=" * 70)
+        self._emit("\n1. Open terminal in your LANA project folder")
+        self._emit("2. Run: python lana_server_fixed.py")
+        self._emit("3. You should see:")
+        self._emit("   ✅ LM Studio connection established")
+        self._emit("   🚀 LANA OS-Link Ready")
+        self._emit(f"\n4. Server will listen on port 6969")
     
+    @buffered
     def print_summary(self):
         """Print final summary"""
-        print("\n📊 CONNECTION TEST SUMMARY\n")
+        self._emit("\n📊 CONNECTION TEST SUMMARY\n")
         
         if not self.issues and not self.warnings:
-            print("✅ ALL SYSTEMS GO!")
-            print("\n🎯 NEXT STEPS FOR YOUR HOMELINK APP:\n")
-            print(f"1. In your Homelink mobile app settings:")
-            print(f"   • Set server URL to: http://{self.local_ip}:6969")
-            print(f"   • Test connection")
-            print()
-            print(f"2. Make sure your phone and PC are on the SAME WiFi network")
-            print()
-            print(f"3. If using firewall, allow port 6969")
-            print()
-            print(f"4. Send test message from app to verify it works")
+            self._emit("✅ ALL SYSTEMS GO!")
+            self._emit("\n🎯 NEXT STEPS FOR YOUR HOMELINK APP:\n")
+            self._emit(f"1. In your Homelink mobile app settings:")
+            self._emit(f"   • Set server URL to: http://{self.local_ip}:6969")
+            self._emit(f"   • Test connection")
+            self._emit()
+            self._emit(f"2. Make sure your phone and PC are on the SAME WiFi network")
+            self._emit()
+            self._emit(f"3. If using firewall, allow port 6969")
+            self._emit()
+            self._emit(f"4. Send test message from app to verify it works")
             return
         
         if self.issues:
-            print(f"❌ CRITICAL ISSUES ({len(self.issues)}):")
+            self._emit(f"❌ CRITICAL ISSUES ({len(self.issues)}):")
             for i, issue in enumerate(self.issues, 1):
-                print(f"   {i}. {issue}")
-            print()
+                self._emit(f"   {i}. {issue}")
+            self._emit()
         
         if self.warnings:
-            print(f"⚠️ WARNINGS ({len(self.warnings)}):")
+            self._emit(f"⚠️ WARNINGS ({len(self.warnings)}):")
             for i, warning in enumerate(self.warnings, 1):
-                print(f"   {i}. {warning}")
-            print()
+                self._emit(f"   {i}. {warning}")
+            self._emit()
         
-        print("\n🎯 ACTION ITEMS:\n")
+        self._emit("\n🎯 ACTION ITEMS:\n")
         
         if "lana_config.json not found" in self.issues:
-            print("   1. Create lana_config.json (see template above)")
+            self._emit("   1. Create lana_config.json (see template above)")
         
         if any("LM Studio" in i for i in self.issues):
-            print("   2. Start LM Studio server")
+            self._emit("   2. Start LM Studio server")
         
         if any("server not running" in w.lower() for w in self.warnings):
-            print("   3. Start LANA server: python lana_server_fixed.py")
+            self._emit("   3. Start LANA server: python lana_server_fixed.py")
         
         if any("localhost" in w for w in self.warnings):
-            print(f"   4. Update config to use {self.local_ip} instead of localhost")
+            self._emit(f"   4. Update config to use {self.local_ip} instead of localhost")
         
-        print(f"\n   5. In Homelink app, set server to: http://{self.local_ip}:6969")
-        print(f"   6. Ensure phone and PC are on same WiFi network")
+        self._emit(f"\n   5. In Homelink app, set server to: http://{self.local_ip}:6969")
+        self._emit(f"   6. Ensure phone and PC are on same WiFi network")
 
 
 def main():
@@ -376,5 +482,4 @@ def main():
 
 
 if __name__ == "__main__":
-    import sys
     sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+lana_common.py
+Helpers shared by the LANA server, LM Studio client and diagnostic scripts
+"""
+
+import functools
+import json
+import re
+from typing import Any, Dict, Optional
+
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is used without it
+    orjson = None
+
+
+# =========================
+# JSON
+# =========================
+
+def json_loads(data):
+    """Parse JSON from str or bytes, using orjson when installed"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON bytes, using orjson when installed"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+
+# =========================
+# HTTP
+# =========================
+
+# Ride out the 502/503/504s LM Studio returns while a model is loading.
+# Connect/read failures are not retried so a dead host still fails fast.
+LOADING_RETRY = Retry(
+    total=2,
+    connect=0,
+    read=0,
+    backoff_factor=0.25,
+    status_forcelist=(502, 503, 504),
+    raise_on_status=False
+)
+
+# Leading "content" string of a chat completion body, escapes kept intact
+_CONTENT_RE = re.compile(r'"content"\s*:\s*"((?:[^"\\]|\\.){0,200})')
+
+
+def extract_content(text: str) -> Optional[str]:
+    """Pull the first ~200 chars of message content without parsing the whole body"""
+    m = _CONTENT_RE.search(text)
+    if not m:
+        return None
+    try:
+        return json.loads(f'"{m.group(1)}"')
+    except ValueError:
+        # Cut mid-\uXXXX escape; the raw fragment is fine for display
+        return m.group(1)
+
+
+# =========================
+# DIAGNOSTICS
+# =========================
+
+def buffered(method):
+    """Flush the instance's output buffer once the wrapped step finishes"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._flush()
+    return wrapper
+
+
+@functools.lru_cache(maxsize=4)
+def load_config_cached(path: str, mtime: float) -> Dict[str, Any]:
+    """Parse a config file; keyed on mtime so edits are picked up"""
+    with open(path, "rb") as f:
+        return json_loads(f.read())
@@ -1,23 +1,69 @@
 """
 lana_server_fixed.py
 Updated LANA server with proper LM Studio connection management
+
+Production: gunicorn -c gunicorn.conf.py lana_server_fixed:app
 """
 
-from flask import Flask, request, jsonify
+# Must run before anything imports socket/ssl/threading so the blocking
+# requests calls to LM Studio become cooperative greenlets
+try:
+    from gevent import get_hub, monkey
+    monkey.patch_all()
+except ImportError:  # Optional; falls back to Flask's threaded dev server
+    monkey = None
+
+from flask import Flask, Response, request, jsonify
+import atexit
+import functools
 import json
+import logging
+import logging.handlers
 import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    from flask_orjson import OrjsonProvider
+except ImportError:  # Optional; Flask's default JSON provider is used without it
+    OrjsonProvider = None
+
+from lana_common import json_dumps, json_loads
 from lm_studio_client import get_client
 from intent_engine import match_intent
 from actions import execute_command
 from vision_router import handle_vision_intent, VISION_INTENTS
 
+# =========================
+# LOGGING
+# =========================
+
+# Request threads only enqueue records; a listener thread formats and writes
+# them. Set LANA_LOG_LEVEL=DEBUG to see per-request detail.
+_log_q = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_q, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger("lana")
+logger.addHandler(logging.handlers.QueueHandler(_log_q))
+logger.setLevel(os.getenv("LANA_LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+
+
 # =========================
 # FLASK APP
 # =========================
 
 app = Flask(__name__)
 
+# Route request.get_json()/jsonify through orjson when available
+if OrjsonProvider:
+    app.json = OrjsonProvider(app)
+
 # =========================
 # BOOT
 # =========================
@@ -26,25 +72,38 @@ print("=" * 50)
 print("🖤 LANA OS-Link Server Starting...")
 print("=" * 50)
 
+# Initialize LM Studio client
+lm_client = get_client()
+
+
+def _boot_probe():
+    """Health check plus model list, run off the main thread during boot"""
+    healthy = lm_client.health_check()
+    return healthy, lm_client.get_loaded_models() if healthy else None
+
+
+# The LM Studio probe is network-bound and independent of the manifest,
+# so start it now and collect the result once the manifest is loaded
+_boot_executor = ThreadPoolExecutor(max_workers=1)
+_boot_future = _boot_executor.submit(_boot_probe)
+_boot_executor.shutdown(wait=False)
+
 # Load manifest
-with open("lana_manifest.json", "r") as f:
-    lana_manifest = json.load(f)
+with open("lana_manifest.json", "rb") as f:
+    lana_manifest = json_loads(f.read())
 
 print(f"📋 Manifest loaded:")
 print(f"   Type: {lana_manifest.get('type')}")
 print(f"   User: {lana_manifest.get('linked_user')}")
 print(f"   Signature: {lana_manifest.get('signature')}")
 
-# Initialize LM Studio client
-lm_client = get_client()
-
 print("\n🔌 Testing LM Studio connection...")
-if lm_client.health_check(force=True):
+lm_healthy, models = _boot_future.result()
+if lm_healthy:
     print("✅ LM Studio connection established")
     
     # Verify models
     print("\n📦 Checking loaded models...")
-    models = lm_client.get_loaded_models()
     
     if models:
         config = lm_client.get_config()
@@ -79,23 +138,26 @@ print("=" * 50 + "\n")
 # =========================
 
 MEMORY_FILE = "learned_triggers.json"
+MEMORY_LOG_FILE = MEMORY_FILE + ".jsonl"  # Append-only log of entries since last snapshot
+MEMORY_LIMIT = 100
+MEMORY_COMPACT_EVERY = 20  # Rewrite the full snapshot after this many appends
+MEMORY_BATCH_SIZE = 64  # Max entries written per batch
+MEMORY_BATCH_WAIT = 0.2  # Seconds to wait for more entries before writing
+MEMORY_FSYNC_EVERY = 10  # fsync the append log after this many batches
 
-def load_memory():
-    """Load conversation memory from file"""
-    if not os.path.exists(MEMORY_FILE):
-        return {
-            "recent_memory": [],
-            "known_intents": {}
-        }
+def _read_memory():
+    """Read conversation memory snapshot from disk and replay any logged entries"""
+    data = {
+        "recent_memory": [],
+        "known_intents": {}
+    }
     
-    try:
-        with open(MEMORY_FILE, "r") as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
-        return {
-            "recent_memory": [],
-            "known_intents": {}
-        }
+    if os.path.exists(MEMORY_FILE):
+        try:
+            with open(MEMORY_FILE, "rb") as f:
+                data = json_loads(f.read())
+        except json.JSONDecodeError:
+            pass
     
     # Ensure structure
     if "recent_memory" not in data:
@@ -103,20 +165,248 @@ def load_memory():
     if "known_intents" not in data:
         data["known_intents"] = {}
     
+    # Bounded buffer: appends past the limit evict the oldest entry
+    data["recent_memory"] = deque(data["recent_memory"], maxlen=MEMORY_LIMIT)
+    
+    # Replay entries appended since the last snapshot
+    if os.path.exists(MEMORY_LOG_FILE):
+        with open(MEMORY_LOG_FILE, "rb") as f:
+            for line in f:
+                try:
+                    data["recent_memory"].append(json_loads(line))
+                except json.JSONDecodeError:
+                    # Skip a torn final line from an interrupted write
+                    continue
+    
     return data
 
 
-def save_context(entry):
-    """Save conversation entry to memory"""
-    data = load_memory()
-    data["recent_memory"].append(entry)
+# Read once at boot; after that the files are only ever written by this process
+_memory = _read_memory()
+_memory_lock = threading.Lock()
+_memory_pending = 0
+_memory_batches = 0
+
+# Entries are queued by request handlers and written by a single writer thread
+_ctx_q = queue.SimpleQueue()
+_CTX_STOP = object()  # Queued at exit to stop the writer
+_log_fd = os.open(MEMORY_LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+def _blocking_io(fn, *args):
+    """
+    Run a blocking file call; under gevent it goes to the hub's native
+    threadpool so disk writes and fsync don't stall the event loop
+    """
+    if monkey:
+        return get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+def _write_snapshot(data):
+    """Replace the snapshot file and empty the append log"""
+    with open(MEMORY_FILE, "wb") as f:
+        f.write(data)
+    os.ftruncate(_log_fd, 0)
+
+
+def _append_log(data, fsync):
+    """Append serialized entries to the log, optionally syncing to disk"""
+    os.write(_log_fd, data)
+    if fsync:
+        os.fsync(_log_fd)
+
+
+def load_memory():
+    """Return conversation memory (in-process copy, no disk access)"""
+    return _memory
+
+
+def flush_memory():
+    """Write the full memory snapshot and truncate the append log"""
+    global _memory_pending
+    
+    with _memory_lock:
+        snapshot = {**_memory, "recent_memory": list(_memory["recent_memory"])}
+        _blocking_io(_write_snapshot, json_dumps(snapshot, indent=True))
+        _memory_pending = 0
+
+
+def _write_batch(batch):
+    """Add a batch of entries to memory and the append log"""
+    global _memory_pending, _memory_batches
+    
+    # Serialize first so a bad entry never reaches the in-memory copy,
+    # where it would break every later snapshot
+    entries = []
+    lines = []
+    for entry in batch:
+        try:
+            lines.append(json_dumps(entry) + b"\n")
+        except (TypeError, ValueError) as e:
+            logger.error("❌ Dropping memory entry that can't be serialized: %s", e)
+            continue
+        entries.append(entry)
+    
+    if not entries:
+        return
+    
+    with _memory_lock:
+        _memory_batches += 1
+        _blocking_io(
+            _append_log,
+            b"".join(lines),
+            _memory_batches % MEMORY_FSYNC_EVERY == 0
+        )
+        
+        # Deque drops the oldest entry past the last 100
+        _memory["recent_memory"].extend(entries)
+        
+        _memory_pending += len(entries)
+        compact = _memory_pending >= MEMORY_COMPACT_EVERY
+    
+    if compact:
+        flush_memory()
+
+
+def _ctx_writer():
+    """Drain queued entries into batches and write them off the request path"""
+    stopping = False
     
-    # Keep only last 100 entries
-    if len(data["recent_memory"]) > 100:
-        data["recent_memory"] = data["recent_memory"][-100:]
+    while not stopping:
+        item = _ctx_q.get()
+        if item is _CTX_STOP:
+            return
+        
+        batch = [item]
+        deadline = time.monotonic() + MEMORY_BATCH_WAIT
+        
+        while len(batch) < MEMORY_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = _ctx_q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _CTX_STOP:
+                # Write what's already been taken, then exit
+                stopping = True
+                break
+            batch.append(item)
+        
+        try:
+            _write_batch(batch)
+        except Exception:
+            logger.exception("⚠️ Failed to save memory")
+
+
+def _shutdown_memory():
+    """Stop the writer once it has written everything queued, then snapshot memory"""
+    _ctx_q.put_nowait(_CTX_STOP)
+    _ctx_thread.join(timeout=5)
+    
+    # Anything the writer didn't get to (e.g. it was stuck on I/O)
+    batch = []
+    while True:
+        try:
+            item = _ctx_q.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _CTX_STOP:
+            batch.append(item)
+    
+    if batch:
+        _write_batch(batch)
+    flush_memory()
+
+
+def save_context(entry):
+    """Queue conversation entry to be saved to memory"""
+    _ctx_q.put_nowait(entry)
+
+
+_ctx_thread = threading.Thread(target=_ctx_writer, name="memory-writer", daemon=True)
+_ctx_thread.start()
+atexit.register(_shutdown_memory)
+
+# =========================
+# PROMPTS
+# =========================
+
+@functools.lru_cache(maxsize=64)
+def _sys_prompt(user):
+    """System prompt for a linked user (built once per user)"""
+    return (
+        f"You are LANA, a helpful AI assistant linked to {user}. "
+        "Be warm, concise, and helpful."
+    )
+
+# =========================
+# STREAMING
+# =========================
+
+_SSE_DONE = b"data: [DONE]\n\n"
+
+
+def _sse_chunk(content=None, finish_reason=None):
+    """One OpenAI-style chat.completion.chunk as an SSE event"""
+    return b"data: " + json_dumps({
+        "id": "lana-local",
+        "object": "chat.completion.chunk",
+        "model": lm_client.primary_model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"content": content} if content is not None else {},
+                "finish_reason": finish_reason
+            }
+        ]
+    }) + b"\n\n"
+
+
+def _stream_text(text):
+    """Send an already complete reply as a single SSE chunk"""
+    yield _sse_chunk(text)
+    yield _sse_chunk(finish_reason="stop")
+    yield _SSE_DONE
+
+
+def _stream_llm_reply(prompt, system_prompt, linked_user):
+    """
+    Relay LM Studio's reply as OpenAI-style SSE chunks, then save it to
+    memory once the stream ends (or the client goes away)
+    """
+    parts = []
     
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    try:
+        for piece in lm_client.chat_completion_stream(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            assume_healthy=True
+        ):
+            parts.append(piece)
+            yield _sse_chunk(piece)
+        
+        if not parts:
+            parts.append("I'm having trouble generating a response right now.")
+            yield _sse_chunk(parts[0])
+        
+        yield _sse_chunk(finish_reason="stop")
+        yield _SSE_DONE
+        
+    finally:
+        # Runs on disconnect too, so whatever was sent is remembered
+        response_text = "".join(parts)
+        
+        logger.debug("💬 LANA: %.100s%s", response_text, "..." if len(response_text) > 100 else "")
+        
+        save_context({
+            "user": linked_user,
+            "prompt": prompt,
+            "response": response_text,
+            "intent": None
+        })
 
 # =========================
 # ROUTES
@@ -162,6 +452,9 @@ def chat_completions():
     try:
         body = request.get_json(force=True)
         
+        # OpenAI-style clients ask for SSE; every reply path honours it
+        stream = bool(body.get("stream"))
+        
         # Extract prompt (support multiple formats)
         prompt = body.get("prompt") or body.get("input")
         
@@ -177,7 +470,7 @@ def chat_completions():
         # Get user identifier
         linked_user = body.get("linked_user", lana_manifest.get("linked_user", "unknown"))
         
-        print(f"\n💬 [{linked_user}]: {prompt}")
+        logger.debug("💬 [%s]: %s", linked_user, prompt)
         
         # =========================
         # INTENT MATCHING
@@ -186,11 +479,11 @@ def chat_completions():
         intent = match_intent(prompt)
         
         if intent:
-            print(f"🎯 Intent matched: {intent}")
+            logger.debug("🎯 Intent matched: %s", intent)
             
             # Check if vision intent
             if intent in VISION_INTENTS:
-                print("👁️ Processing vision request...")
+                logger.debug("👁️ Processing vision request...")
                 vision_result = handle_vision_intent(intent, prompt)
                 
                 if "error" in vision_result:
@@ -200,12 +493,12 @@ def chat_completions():
             
             else:
                 # Execute local command
-                print("⚙️ Executing local command...")
+                logger.debug("⚙️ Executing local command...")
                 response_text = execute_command(intent, prompt)
         
         else:
             # No intent match - forward to LLM
-            print("🤖 Forwarding to LLM...")
+            logger.debug("🤖 Forwarding to LLM...")
             
             # Check LM Studio connection
             if not lm_client.health_check():
@@ -215,14 +508,19 @@ def chat_completions():
                 )
             else:
                 # Send to LLM
-                system_prompt = (
-                    f"You are LANA, a helpful AI assistant linked to {linked_user}. "
-                    "Be warm, concise, and helpful."
-                )
+                system_prompt = _sys_prompt(linked_user)
+                
+                # Stream tokens back as they're generated when asked to
+                if stream:
+                    return Response(
+                        _stream_llm_reply(prompt, system_prompt, linked_user),
+                        mimetype="text/event-stream"
+                    )
                 
                 llm_response = lm_client.chat_completion(
                     prompt=prompt,
-                    system_prompt=system_prompt
+                    system_prompt=system_prompt,
+                    assume_healthy=True
                 )
                 
                 if llm_response:
@@ -230,7 +528,7 @@ def chat_completions():
                 else:
                     response_text = "I'm having trouble generating a response right now."
         
-        print(f"💬 LANA: {response_text[:100]}{'...' if len(response_text) > 100 else ''}")
+        logger.debug("💬 LANA: %.100s%s", response_text, "..." if len(response_text) > 100 else "")
         
         # =========================
         # SAVE MEMORY
@@ -247,6 +545,13 @@ def chat_completions():
         # RETURN RESPONSE
         # =========================
         
+        if stream:
+            return Response(_stream_text(response_text), mimetype="text/event-stream")
+        
+        # Rough word-based token counts, each computed once
+        prompt_tokens = len(prompt.split())
+        completion_tokens = len(response_text.split())
+        
         return jsonify({
             "id": "lana-local",
             "object": "chat.completion",
@@ -262,16 +567,15 @@ def chat_completions():
                 }
             ],
             "usage": {
-                "prompt_tokens": len(prompt.split()),
-                "completion_tokens": len(response_text.split()),
-                "total_tokens": len(prompt.split()) + len(response_text.split())
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
             }
         })
     
     except Exception as e:
-        print(f"❌ Error in chat_completions: {e}")
-        import traceback
-        traceback.print_exc()
+        # Goes through the log queue rather than straight to stderr
+        logger.exception("❌ Error in chat_completions: %s", e)
         
         return jsonify({
             "error": str(e),
@@ -308,8 +612,16 @@ if __name__ == "__main__":
     
     print(f"🌐 Starting server on {server_config['host']}:{server_config['port']}")
     
-    app.run(
-        host=server_config["host"],
-        port=server_config["port"],
-        debug=False
-    )
+    if monkey:
+        from gevent.pywsgi import WSGIServer
+        
+        WSGIServer(
+            (server_config["host"], server_config["port"]),
+            app
+        ).serve_forever()
+    else:
+        app.run(
+            host=server_config["host"],
+            port=server_config["port"],
+            debug=False
+        )
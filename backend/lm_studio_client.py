@@ -3,17 +3,47 @@ lm_studio_client.py
 Unified LM Studio connection manager with health checks and error handling
 """
 
+import functools
 import json
+import logging
 import requests
+import socket
+import threading
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-from typing import Optional, Dict, Any, List
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Iterator, List, Mapping
+
+from lana_common import LOADING_RETRY, json_dumps, json_loads
+
+logger = logging.getLogger("lana.client")
+
+
+@functools.lru_cache(maxsize=4)
+def _load_config(path: str) -> Mapping[str, Any]:
+    """Load configuration from JSON file (parsed once per path, read-only)"""
+    try:
+        with open(path, "rb") as f:
+            return MappingProxyType(json_loads(f.read()))
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f"Configuration file not found: {path}\n"
+            "Please create lana_config.json with LM Studio settings."
+        )
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in config file: {e}")
 
 
 class LMStudioClient:
     """Centralized client for all LM Studio API interactions"""
     
+    HEALTH_CACHE_TTL = 60  # Seconds a health check result is reused
+    _IMG_URL_PREFIX = "data:image/jpeg;base64,"
+    
     def __init__(self, config_path: str = "lana_config.json"):
-        self.config = self._load_config(config_path)
+        self.config = _load_config(config_path)
         self.base_url = self.config["lm_studio"]["base_url"]
         self.chat_endpoint = self.base_url + self.config["lm_studio"]["endpoints"]["chat"]
         self.models_endpoint = self.base_url + self.config["lm_studio"]["endpoints"]["models"]
@@ -24,86 +54,141 @@ class LMStudioClient:
         self.max_retries = self.config["retry"]["max_attempts"]
         self.retry_delay = self.config["retry"]["delay_seconds"]
         
+        # Host/port for the cheap TCP liveness probe
+        url = urlsplit(self.base_url)
+        self._host = url.hostname
+        self._port = url.port or (443 if url.scheme == "https" else 80)
+        
         self._last_health_check = None
         self._is_healthy = False
-    
-    def _load_config(self, path: str) -> dict:
-        """Load configuration from JSON file"""
-        try:
-            with open(path, "r") as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise FileNotFoundError(
-                f"Configuration file not found: {path}\n"
-                "Please create lana_config.json with LM Studio settings."
+        self._health_lock = threading.Lock()
+        
+        # Pooled keep-alive session sized for concurrent chat/vision bursts;
+        # LOADING_RETRY rides out model loads, other failures go to callers
+        self._session = requests.Session()
+        self._session.headers["Connection"] = "keep-alive"
+        adapter = HTTPAdapter(
+            pool_connections=64,
+            pool_maxsize=64,
+            max_retries=LOADING_RETRY
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        
+        # chat_completion alone gets the configured retry policy with
+        # exponential backoff. It has its own session so vision uploads and
+        # streams to the same URL are never re-sent.
+        self._chat_session = requests.Session()
+        self._chat_session.headers["Connection"] = "keep-alive"
+        chat_adapter = HTTPAdapter(
+            pool_connections=64,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=self.max_retries - 1,
+                backoff_factor=self.retry_delay,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["POST", "GET"]),
+                raise_on_status=False
             )
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON in config file: {e}")
+        )
+        self._chat_session.mount("http://", chat_adapter)
+        self._chat_session.mount("https://", chat_adapter)
     
-    def health_check(self, force: bool = False) -> bool:
+    def health_check(self, force_full: bool = False) -> bool:
         """
         Check if LM Studio is accessible
-        Uses cached result unless forced or stale (>30 seconds)
+        Uses cached result unless stale (>60 seconds)
+        
+        A TCP connect is enough to tell whether the server is up; pass
+        force_full=True to make a real GET /v1/models instead (diagnostics).
         """
-        now = time.time()
+        if not force_full and self._health_is_fresh():
+            return self._is_healthy
         
-        # Use cached result if recent
-        if not force and self._last_health_check:
-            if now - self._last_health_check < 30:
+        # Single-flight: one caller probes, concurrent callers wait for it
+        # and reuse its result instead of probing again
+        with self._health_lock:
+            if not force_full and self._health_is_fresh():
                 return self._is_healthy
-        
+            
+            healthy = self._probe_http() if force_full else self._probe_socket()
+            
+            if healthy and not self._is_healthy:
+                logger.info("✅ LM Studio connected at %s", self.base_url)
+            
+            self._is_healthy = healthy
+            self._last_health_check = time.monotonic()
+            return healthy
+    
+    def _health_is_fresh(self) -> bool:
+        """Whether the cached health result is still within its TTL"""
+        return (
+            self._last_health_check is not None
+            and time.monotonic() - self._last_health_check < self.HEALTH_CACHE_TTL
+        )
+    
+    def _probe_socket(self) -> bool:
+        """Open and close a TCP connection to LM Studio"""
+        try:
+            socket.create_connection(
+                (self._host, self._port),
+                timeout=self.health_timeout
+            ).close()
+            return True
+            
+        except socket.timeout:
+            logger.warning("⏱️ Connection to LM Studio timed out")
+            return False
+            
+        except OSError:
+            logger.error("❌ Cannot connect to LM Studio at %s", self.base_url)
+            logger.error("   Make sure LM Studio is running and the server is started.")
+            return False
+    
+    def _probe_http(self) -> bool:
+        """Request the models list and check LM Studio answers with 200"""
         try:
-            response = requests.get(
+            response = self._session.get(
                 self.models_endpoint,
                 timeout=self.health_timeout
             )
             
-            self._is_healthy = response.status_code == 200
-            self._last_health_check = now
-            
-            if self._is_healthy:
-                print(f"✅ LM Studio connected at {self.base_url}")
-            else:
-                print(f"⚠️ LM Studio responded with status {response.status_code}")
+            if response.status_code != 200:
+                logger.warning("⚠️ LM Studio responded with status %s", response.status_code)
+                return False
             
-            return self._is_healthy
+            return True
             
         except requests.exceptions.ConnectionError:
-            self._is_healthy = False
-            self._last_health_check = now
-            print(f"❌ Cannot connect to LM Studio at {self.base_url}")
-            print("   Make sure LM Studio is running and the server is started.")
+            logger.error("❌ Cannot connect to LM Studio at %s", self.base_url)
+            logger.error("   Make sure LM Studio is running and the server is started.")
             return False
             
         except requests.exceptions.Timeout:
-            self._is_healthy = False
-            self._last_health_check = now
-            print(f"⏱️ Connection to LM Studio timed out")
+            logger.warning("⏱️ Connection to LM Studio timed out")
             return False
             
         except Exception as e:
-            self._is_healthy = False
-            self._last_health_check = now
-            print(f"❌ Health check error: {e}")
+            logger.error("❌ Health check error: %s", e)
             return False
     
     def get_loaded_models(self) -> Optional[List[str]]:
         """Get list of currently loaded models in LM Studio"""
         try:
-            response = requests.get(
+            response = self._session.get(
                 self.models_endpoint,
                 timeout=self.health_timeout
             )
             response.raise_for_status()
             
-            data = response.json()
+            data = json_loads(response.content)
             models = [model["id"] for model in data.get("data", [])]
             
-            print(f"📋 Loaded models: {models}")
+            logger.debug("📋 Loaded models: %s", models)
             return models
             
         except Exception as e:
-            print(f"❌ Failed to get models: {e}")
+            logger.error("❌ Failed to get models: %s", e)
             return None
     
     def verify_model(self, model_name: str) -> bool:
@@ -115,18 +200,42 @@ class LMStudioClient:
         is_loaded = model_name in models
         
         if not is_loaded:
-            print(f"⚠️ Model '{model_name}' not loaded in LM Studio")
-            print(f"   Available models: {models}")
+            logger.warning("⚠️ Model '%s' not loaded in LM Studio", model_name)
+            logger.warning("   Available models: %s", models)
         
         return is_loaded
     
+    def _chat_payload(
+        self,
+        prompt: str,
+        model: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        system_prompt: Optional[str],
+        stream: bool
+    ) -> Dict[str, Any]:
+        """Build the request body for a chat completion"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        
+        return {
+            "model": model or self.primary_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+    
     def chat_completion(
         self,
         prompt: str,
         model: Optional[str] = None,
         temperature: float = 0.7,
         max_tokens: int = 1000,
-        system_prompt: Optional[str] = None
+        system_prompt: Optional[str] = None,
+        assume_healthy: bool = False
     ) -> Optional[str]:
         """
         Send a chat completion request to LM Studio
@@ -137,76 +246,119 @@ class LMStudioClient:
             temperature: Sampling temperature
             max_tokens: Maximum tokens to generate
             system_prompt: Optional system message
+            assume_healthy: Skip the health check (caller just did one)
             
         Returns:
             Generated text or None if failed
         """
         
         # Health check first
-        if not self.health_check():
+        if not assume_healthy and not self.health_check():
             return None
         
-        model = model or self.primary_model
+        payload = self._chat_payload(
+            prompt, model, temperature, max_tokens, system_prompt, stream=False
+        )
         
-        # Build messages
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        # Retries and backoff are handled by the chat session's adapter
+        try:
+            response = self._chat_session.post(
+                self.chat_endpoint,
+                json=payload,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            
+            data = json_loads(response.content)
+            content = data["choices"][0]["message"]["content"]
+            
+            return content
+            
+        except requests.exceptions.Timeout:
+            logger.warning("⏱️ Request timed out after %s attempts", self.max_retries)
+            
+        except requests.exceptions.ConnectionError:
+            logger.error("❌ Connection failed after %s attempts", self.max_retries)
+            
+        except requests.exceptions.HTTPError as e:
+            logger.error("❌ HTTP error: %s", e)
+            
+        except KeyError:
+            logger.error("❌ Unexpected response format from LM Studio")
+            
+        except Exception as e:
+            logger.error("❌ Unexpected error: %s", e)
         
-        payload = {
-            "model": model,
-            "messages": messages,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "stream": False
-        }
+        return None
+    
+    def chat_completion_stream(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        temperature: float = 0.7,
+        max_tokens: int = 1000,
+        system_prompt: Optional[str] = None,
+        assume_healthy: bool = False
+    ) -> Iterator[str]:
+        """
+        Stream a chat completion from LM Studio, yielding text as it arrives
+        
+        Takes the same arguments as chat_completion. Yields nothing if the
+        request fails; errors are logged, not raised.
+        """
+        
+        if not assume_healthy and not self.health_check():
+            return
+        
+        payload = self._chat_payload(
+            prompt, model, temperature, max_tokens, system_prompt, stream=True
+        )
         
-        # Retry logic
-        for attempt in range(self.max_retries):
-            try:
-                response = requests.post(
-                    self.chat_endpoint,
-                    json=payload,
-                    timeout=self.timeout
-                )
+        try:
+            with self._session.post(
+                self.chat_endpoint,
+                json=payload,
+                timeout=self.timeout,
+                stream=True
+            ) as response:
                 response.raise_for_status()
                 
-                data = response.json()
-                content = data["choices"][0]["message"]["content"]
-                
-                return content
-                
-            except requests.exceptions.ConnectionError:
-                print(f"❌ Connection failed (attempt {attempt + 1}/{self.max_retries})")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
+                # Server-sent events: one "data: {...}" line per chunk
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
                     
-            except requests.exceptions.Timeout:
-                print(f"⏱️ Request timed out (attempt {attempt + 1}/{self.max_retries})")
-                if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay)
+                    data = line[6:]
+                    if data == b"[DONE]":
+                        break
                     
-            except requests.exceptions.HTTPError as e:
-                print(f"❌ HTTP error: {e}")
-                return None
-                
-            except KeyError:
-                print(f"❌ Unexpected response format from LM Studio")
-                return None
-                
-            except Exception as e:
-                print(f"❌ Unexpected error: {e}")
-                return None
-        
-        return None
+                    chunk = json_loads(data)
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+                        
+        except requests.exceptions.ConnectionError:
+            logger.error("❌ Connection to LM Studio failed")
+            
+        except requests.exceptions.Timeout:
+            logger.warning("⏱️ Request timed out")
+            
+        except requests.exceptions.HTTPError as e:
+            logger.error("❌ HTTP error: %s", e)
+            
+        except (KeyError, IndexError):
+            logger.error("❌ Unexpected response format from LM Studio")
+            
+        except Exception as e:
+            logger.error("❌ Unexpected error: %s", e)
     
     def vision_completion(
         self,
         prompt: str,
         image_base64: str,
         model: Optional[str] = None,
-        temperature: float = 0.2
+        temperature: float = 0.2,
+        assume_healthy: bool = False
     ) -> Optional[str]:
         """
         Send a vision completion request with image
@@ -216,12 +368,13 @@ class LMStudioClient:
             image_base64: Base64-encoded image
             model: Vision model name (uses vision model if not specified)
             temperature: Sampling temperature
+            assume_healthy: Skip the health check (caller just did one)
             
         Returns:
             Generated text or None if failed
         """
         
-        if not self.health_check():
+        if not assume_healthy and not self.health_check():
             return None
         
         model = model or self.vision_model
@@ -236,7 +389,7 @@ class LMStudioClient:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": self._IMG_URL_PREFIX + image_base64
                             }
                         }
                     ]
@@ -246,23 +399,25 @@ class LMStudioClient:
         }
         
         try:
-            response = requests.post(
+            # Serialized in one pass; the base64 image dominates the body
+            response = self._session.post(
                 self.chat_endpoint,
-                json=payload,
+                data=json_dumps(payload),
+                headers={"Content-Type": "application/json"},
                 timeout=self.config["timeouts"]["vision_request"]
             )
             response.raise_for_status()
             
-            data = response.json()
+            data = json_loads(response.content)
             content = data["choices"][0]["message"]["content"]
             
             return content
             
         except Exception as e:
-            print(f"❌ Vision request failed: {e}")
+            logger.error("❌ Vision request failed: %s", e)
             return None
     
-    def get_config(self) -> Dict[str, Any]:
+    def get_config(self) -> Mapping[str, Any]:
         """Return current configuration"""
         return self.config
 
@@ -293,13 +448,14 @@ def is_connected() -> bool:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print("🔧 LM Studio Client Test\n")
     
     client = LMStudioClient()
     
     # Test connection
     print("1. Testing connection...")
-    if client.health_check(force=True):
+    if client.health_check(force_full=True):
         print("   ✅ Connection successful\n")
     else:
         print("   ❌ Connection failed\n")
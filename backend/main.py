@@ -3,19 +3,41 @@ import json
 import httpx
 import uvicorn
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request, Header
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 
+try:
+    import orjson
+except ImportError:  # Optional speedup; stdlib json is used without it
+    orjson = None
+
 # --- CONFIGURATION ---
 # LM Studio default OpenAI-compatible API endpoint
 LM_STUDIO_URL = "http://127.0.0.1:1234/v1"
 # Shared secret for mobile-to-proxy authentication
 API_KEY = "home-link-secret" 
 
-app = FastAPI(title="HomeLink Proxy")
+# One pooled client for the whole process so concurrent requests share
+# keep-alive connections to LM Studio instead of opening their own
+_client = httpx.AsyncClient(
+    timeout=120.0,
+    limits=httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await _client.aclose()
+
+app = FastAPI(
+    title="HomeLink Proxy",
+    default_response_class=ORJSONResponse if orjson else JSONResponse,
+    lifespan=lifespan
+)
 
 # EXTREMELY permissive CORS for local dev and mobile connections
 app.add_middleware(
@@ -53,39 +75,37 @@ async def proxy_chat(request: ChatRequest, x_api_key: Optional[str] = Header(Non
     print(f"DEBUG: Incoming chat request for model: {request.model}")
     
     async def event_generator():
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            try:
-                async with client.stream(
-                    "POST", 
-                    f"{LM_STUDIO_URL}/chat/completions",
-                    json=request.dict(),
-                    headers={"Content-Type": "application/json"}
-                ) as response:
-                    if response.status_code != 200:
-                        error_body = await response.aread()
-                        print(f"DEBUG: LM Studio Error: {error_body.decode()}")
-                        yield f"data: {json.dumps({'error': f'LM Studio error: {error_body.decode()}'})}\n\n"
-                        return
-
-                    async for line in response.aiter_lines():
-                        if line:
-                            yield f"{line}\n\n"
-            except Exception as e:
-                print(f"DEBUG: Proxy exception: {str(e)}")
-                yield f"data: {json.dumps({'error': f'Proxy Error: {str(e)}'})}\n\n"
+        try:
+            async with _client.stream(
+                "POST", 
+                f"{LM_STUDIO_URL}/chat/completions",
+                json=request.dict(),
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                if response.status_code != 200:
+                    error_body = await response.aread()
+                    print(f"DEBUG: LM Studio Error: {error_body.decode()}")
+                    yield f"data: {json.dumps({'error': f'LM Studio error: {error_body.decode()}'})}\n\n"
+                    return
+
+                async for line in response.aiter_lines():
+                    if line:
+                        yield f"{line}\n\n"
+        except Exception as e:
+            print(f"DEBUG: Proxy exception: {str(e)}")
+            yield f"data: {json.dumps({'error': f'Proxy Error: {str(e)}'})}\n\n"
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.get("/models")
 async def get_models(x_api_key: Optional[str] = Header(None)):
     verify_key(x_api_key)
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            resp = await client.get(f"{LM_STUDIO_URL}/models")
-            return resp.json()
-        except Exception as e:
-            print(f"DEBUG: Failed to fetch models: {str(e)}")
-            raise HTTPException(status_code=503, detail="LM Studio unreachable on port 1234. Is LM Studio Server started?")
+    try:
+        resp = await _client.get(f"{LM_STUDIO_URL}/models", timeout=10.0)
+        return orjson.loads(resp.content) if orjson else resp.json()
+    except Exception as e:
+        print(f"DEBUG: Failed to fetch models: {str(e)}")
+        raise HTTPException(status_code=503, detail="LM Studio unreachable on port 1234. Is LM Studio Server started?")
 
 @app.options("/{rest_of_path:path}")
 async def options_handler(request: Request):
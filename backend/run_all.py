@@ -0,0 +1,56 @@
+"""
+run_all.py
+Run both LANA diagnostic suites side by side and report a combined result
+"""
+
+import contextlib
+import io
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+from diagnose_connection import ConnectionDiagnostics
+from homelink_connection_test import HomelinkConnectionTest
+
+
+def _run_conn_diag() -> Tuple[bool, str]:
+    """Run the LM Studio diagnostics, capturing their output"""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ok = ConnectionDiagnostics(deep="--deep" in sys.argv[1:]).run_all_checks()
+    return ok, out.getvalue()
+
+
+def _run_homelink() -> Tuple[bool, str]:
+    """Run the Homelink connection test, capturing its output"""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        ok = HomelinkConnectionTest().run_all_tests()
+    return ok, out.getvalue()
+
+
+def main():
+    """Run both suites in separate processes"""
+    # Processes rather than threads: each suite gets its own interpreter for
+    # the cv2 import and socket work, and output is captured per suite so the
+    # two reports don't interleave
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futures = (executor.submit(_run_conn_diag), executor.submit(_run_homelink))
+        results = [f.result() for f in futures]
+
+    for _, output in results:
+        sys.stdout.write(output)
+        sys.stdout.write("\n")
+
+    ok = all(success for success, _ in results)
+
+    if not ok:
+        print("⚠️ Please fix the issues above before using your Homelink app")
+        return 1
+
+    print("✅ No critical issues found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
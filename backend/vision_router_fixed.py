@@ -3,52 +3,219 @@ vision_router_fixed.py
 Updated vision router using unified LM Studio client
 """
 
-import base64
+import binascii
 import cv2
+import logging
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import IntEnum
 from typing import Optional, Dict, Any
 
 from lm_studio_client import get_client
 from vision_state import update_vision_state
 
-# Vision-specific intents
-VISION_INTENTS = {
-    "see",
-    "see_me",
-    "check_wellbeing",
-    "identify_objects",
-    "read_text",
-    "save_view"
-}
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _tj = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # Optional; falls back to cv2.imencode
+    _tj = None
 
+try:
+    from gevent import monkey
+    _start_os_thread = monkey.get_original("_thread", "start_new_thread")
+except ImportError:  # No gevent; threads are already OS threads
+    from _thread import start_new_thread as _start_os_thread
 
-def _capture_frame() -> Optional[str]:
+logger = logging.getLogger("lana.vision")
+
+# Runs the LM Studio health check while the camera frame is being grabbed
+_health_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lana-vision")
+
+# Capture and encode defaults; override under "vision" in lana_config.json
+CAPTURE_WIDTH = 960
+CAPTURE_HEIGHT = 540
+FRAME_SIZE = 672  # Longest side sent to the vision model
+JPEG_QUALITY = 75
+FIRST_FRAME_TIMEOUT = 10.0  # Seconds to wait for the camera to open and deliver a frame
+
+
+class VisionIntent(IntEnum):
+    """Vision-specific intents; values index _VISION_PROMPTS"""
+    SEE = 0
+    SEE_ME = 1
+    CHECK_WELLBEING = 2
+    IDENTIFY_OBJECTS = 3
+    READ_TEXT = 4
+    SAVE_VIEW = 5
+
+
+# Default prompt per intent, in VisionIntent order
+_VISION_PROMPTS = (
+    "Describe what you see in this image in 2-3 sentences.",
+    
+    (
+        "Is there a person visible in this image? "
+        "If yes, briefly describe what you can see about them (position, posture, etc). "
+        "If no, describe what is visible instead."
+    ),
+    
+    (
+        "Analyze the person in this image. "
+        "Do they appear tired, stressed, energetic, or calm? "
+        "Provide a brief wellbeing assessment based on visible cues."
+    ),
+    
+    (
+        "List all objects you can identify in this image. "
+        "Format: Object 1, Object 2, Object 3, etc."
+    ),
+    
+    (
+        "Extract and transcribe any visible text in this image. "
+        "If no text is visible, state 'No text detected'."
+    ),
+    
+    "Describe this scene in detail for archival purposes."
+)
+
+# Intent names as matched by the intent engine
+_INTENT_IDS = {vi.name.lower(): vi for vi in VisionIntent}
+VISION_INTENTS = frozenset(_INTENT_IDS)
+
+
+class _CameraWorker:
+    """
+    Keeps the camera open and holds on to the most recent frame
+    
+    The capture loop sits in blocking OpenCV calls that never yield to
+    gevent, so it always runs on a real OS thread. Frames are handed over
+    by plain attribute assignment and waiters poll with time.sleep, which
+    yields to other greenlets when gevent is active; no locks or events
+    are shared across threads.
+    """
+    
+    def __init__(self, width: int, height: int, device: int = 0):
+        self._width = width
+        self._height = height
+        self._device = device
+        self._frame = None
+        self._alive = False
+        self.error = None
+    
+    def start(self):
+        """Open the camera on a native thread"""
+        self._alive = True
+        _start_os_thread(self._run, ())
+    
+    def is_alive(self) -> bool:
+        return self._alive
+    
+    def _run(self):
+        backend = cv2.CAP_V4L2 if sys.platform.startswith("linux") else cv2.CAP_ANY
+        cap = None
+        
+        try:
+            cap = cv2.VideoCapture(self._device, backend)
+            if not cap.isOpened():
+                self.error = "❌ Camera could not be opened"
+                return
+            
+            # Only keep one frame queued so reads are always current
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            
+            # No point capturing more pixels than the vision model will see
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self._width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self._height)
+            
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    self.error = "❌ Camera capture failed"
+                    return
+                
+                self._frame = frame
+        except Exception as e:
+            self.error = f"❌ Camera error: {e}"
+        finally:
+            if cap is not None:
+                cap.release()
+            self._frame = None
+            self._alive = False
+    
+    def latest(self, timeout: float = FIRST_FRAME_TIMEOUT):
+        """Most recent frame, waiting up to timeout for the first one"""
+        deadline = time.monotonic() + timeout
+        
+        while self._frame is None and self._alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        return self._frame
+
+
+_camera = None
+_camera_lock = threading.Lock()
+
+
+def _get_camera() -> _CameraWorker:
+    """Start the camera worker on first use, or restart it if it stopped"""
+    global _camera
+    with _camera_lock:
+        if _camera is None or not _camera.is_alive():
+            vision_config = get_client().get_config().get("vision", {})
+            _camera = _CameraWorker(
+                vision_config.get("capture_width", CAPTURE_WIDTH),
+                vision_config.get("capture_height", CAPTURE_HEIGHT)
+            )
+            _camera.start()
+        return _camera
+
+
+def _capture_frame() -> Optional[bytes]:
     """
-    Capture a frame from the camera and return as base64
+    Grab the latest camera frame and return it as JPEG bytes
     
     Returns:
-        Base64-encoded JPEG or None if failed
+        JPEG bytes or None if failed
     """
     try:
-        cap = cv2.VideoCapture(0)
-        time.sleep(0.2)  # Let camera warm up
+        vision_config = get_client().get_config().get("vision", {})
         
-        ret, frame = cap.read()
-        cap.release()
+        camera = _get_camera()
+        frame = camera.latest(
+            vision_config.get("first_frame_timeout", FIRST_FRAME_TIMEOUT)
+        )
         
-        if not ret:
-            print("❌ Camera capture failed")
+        if frame is None:
+            logger.error(camera.error or "❌ No camera frame available")
             return None
         
-        # Encode as JPEG
-        _, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-        image_b64 = base64.b64encode(buffer).decode("utf-8")
+        frame_size = vision_config.get("frame_size", FRAME_SIZE)
+        quality = vision_config.get("jpeg_quality", JPEG_QUALITY)
+        
+        # Downscale to the model's input size, keeping the aspect ratio
+        height, width = frame.shape[:2]
+        scale = frame_size / max(height, width)
+        if scale < 1:
+            frame = cv2.resize(
+                frame,
+                (round(width * scale), round(height * scale)),
+                interpolation=cv2.INTER_AREA
+            )
         
-        print(f"📸 Captured frame ({len(image_b64)} bytes)")
-        return image_b64
+        # Encode as JPEG (libjpeg-turbo's SIMD encoder when available)
+        if _tj:
+            buffer = _tj.encode(frame, quality=quality, jpeg_subsample=TJSAMP_420)
+        else:
+            _, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            buffer = encoded.tobytes()
+        
+        logger.debug("📸 Captured frame (%s bytes)", len(buffer))
+        return buffer
         
     except Exception as e:
-        print(f"❌ Camera error: {e}")
+        logger.error("❌ Camera error: %s", e)
         return None
 
 
@@ -64,40 +231,14 @@ def _get_vision_prompt(intent: str, user_prompt: str = "") -> str:
         Optimized prompt for the vision model
     """
     
-    prompts = {
-        "see": "Describe what you see in this image in 2-3 sentences.",
-        
-        "see_me": (
-            "Is there a person visible in this image? "
-            "If yes, briefly describe what you can see about them (position, posture, etc). "
-            "If no, describe what is visible instead."
-        ),
-        
-        "check_wellbeing": (
-            "Analyze the person in this image. "
-            "Do they appear tired, stressed, energetic, or calm? "
-            "Provide a brief wellbeing assessment based on visible cues."
-        ),
-        
-        "identify_objects": (
-            "List all objects you can identify in this image. "
-            "Format: Object 1, Object 2, Object 3, etc."
-        ),
-        
-        "read_text": (
-            "Extract and transcribe any visible text in this image. "
-            "If no text is visible, state 'No text detected'."
-        ),
-        
-        "save_view": "Describe this scene in detail for archival purposes."
-    }
-    
-    # Use custom prompt or default
+    # User provided specific instructions
     if user_prompt and len(user_prompt) > 10:
-        # User provided specific instructions
         return user_prompt
-    else:
-        return prompts.get(intent, "Describe what you see.")
+    
+    intent_id = _INTENT_IDS.get(intent)
+    if intent_id is None:
+        return "Describe what you see."
+    return _VISION_PROMPTS[intent_id]
 
 
 def handle_vision_intent(
@@ -117,15 +258,21 @@ def handle_vision_intent(
         Dictionary with result or error
     """
     
-    print(f"\n👁️ Vision request: {intent}")
+    logger.debug("👁️ Vision request: %s", intent)
     
     # Update state to active
     update_vision_state(intent=intent, active=True)
     
+    # Get LM Studio client
+    lm_client = get_client()
+    
+    # Check connection while capturing; neither depends on the other
+    health_probe = _health_pool.submit(lm_client.health_check)
+    
     # Capture frame
-    image_b64 = _capture_frame()
+    jpeg_bytes = _capture_frame()
     
-    if not image_b64:
+    if not jpeg_bytes:
         update_vision_state(
             result="Camera capture failed",
             active=False
@@ -142,25 +289,20 @@ def handle_vision_intent(
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"lana_view_{timestamp}.jpg"
             
-            # Decode and save
-            img_data = base64.b64decode(image_b64)
             with open(filename, "wb") as f:
-                f.write(img_data)
+                f.write(jpeg_bytes)
             
-            print(f"💾 Saved image: {filename}")
+            logger.debug("💾 Saved image: %s", filename)
         except Exception as e:
-            print(f"⚠️ Failed to save image: {e}")
+            logger.warning("⚠️ Failed to save image: %s", e)
     
     # Generate appropriate prompt
     vision_prompt = _get_vision_prompt(intent, prompt)
     
-    print(f"🎯 Vision prompt: {vision_prompt[:80]}...")
-    
-    # Get LM Studio client
-    lm_client = get_client()
+    logger.debug("🎯 Vision prompt: %.80s...", vision_prompt)
     
     # Check connection
-    if not lm_client.health_check():
+    if not health_probe.result():
         error_msg = "LM Studio not connected"
         update_vision_state(result=error_msg, active=False)
         return {
@@ -168,15 +310,18 @@ def handle_vision_intent(
             "message": error_msg
         }
     
-    # Send vision request
+    # Send vision request; base64 only now that it's actually going out
     try:
+        image_b64 = binascii.b2a_base64(jpeg_bytes, newline=False).decode("ascii")
+        
         result_text = lm_client.vision_completion(
             prompt=vision_prompt,
-            image_base64=image_b64
+            image_base64=image_b64,
+            assume_healthy=True
         )
         
         if result_text:
-            print(f"✅ Vision result: {result_text[:100]}...")
+            logger.debug("✅ Vision result: %.100s...", result_text)
             
             update_vision_state(
                 result=result_text,
@@ -198,7 +343,7 @@ def handle_vision_intent(
     
     except Exception as e:
         error_msg = str(e)
-        print(f"❌ Vision error: {error_msg}")
+        logger.error("❌ Vision error: %s", error_msg)
         
         update_vision_state(result=error_msg, active=False)
         
@@ -219,6 +364,7 @@ def quick_vision_check() -> Optional[str]:
 # =========================
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     print("🧪 Testing Vision Router\n")
     
     # Test camera